@@ -4,171 +4,219 @@ __author__ = 'nsaintarnaud'
 sudokupy - sovle simple sudoku puzzles
 
 objects
-- Grid = 9x9
-- Digit = 1x1
-- DigitGroup = any of 9x1 (row), 1x9 (col), 3x3 (box)
-
-grid has
-- references to 9 boxes, 9 rows, 9 cols, 81 digits
-
-digit has
-- list of possible values; if the list has size=1 then that's the solution
-- reference to parent grid, row, col and box
-- set method to set the value, which tells its parent row, col and box that
-the value is no longer possible for the other digits
+- Grid = 9x9, top-level container
+
+state
+- grid has one 9-bit mask of possible values per cell, kept in a flat
+array of 81; if only one bit is set then that cell is solved
+- module-level tables, computed once at import, describe the geometry:
+PEERS lists the 20 cells constraining each cell, GROUPS the 27 rows,
+cols and boxes
+- solving clears each solved value from its peers, assigns hidden
+singles, and backtracks over the cell with the fewest candidates when
+propagation stalls
 
 """
 
 import sys
 import argparse
+from array import array
 
 
 # use this character to display an unknown value in a grid
 UNKNOWN_DIGIT_INPUT = "-._ 0"  # any of those will be accepted as unknown
 UNKNOWN_DIGIT_DISPLAY = "-"    # unknown digits will be displayed as this
-ROW_TERMINATOR = "\n\r"
-
-class Digit:
-    """One of the 81 positions in the grid.
-    Keeps track of possible values; if there is only one possible value 
-    then that Digit is solved."""
-
-    def __init__(self, grid, position, row, col, box, 
-            values = [1,2,3,4,5,6,7,8,9]):
-        self.grid = grid
-        self.position = position
-        self.row = row
-        self.col = col
-        self.box = box
-        self.v = set(values)  # possible values
-
-    def solved(self, debug=False):
-        """Digit is solved if only one possible value left"""
-
-        if debug:
-            import pdb; pdb.set_trace()
-        return (1 == len(self.v))
-
-    def getSolvedValue(self):
-        """solved if only one possible value left"""
-        if self.solved():
-            return int(list(self.v)[0])
-        else: 
-            return None
-
-    def setSolvedValue(self, myvalue, propagate=False):
-        self.v = set([myvalue])
-        if propagate:
-            self.propagate()
-
-    def propagate(self):
-        """if the digit is solved, tell the containing row, col and box 
-        that the Digit's value is no longer possible"""
-
-        #import pdb; pdb.set_trace()
-        if self.solved():
-            """this caused the digit to be solved"""
-            self.row.not_possible(self.getSolvedValue())
-            self.col.not_possible(self.getSolvedValue())
-            self.box.not_possible(self.getSolvedValue())
-
-    def not_possible(self, value, recurse=False):
-        """remove the value from the possible values"""
-        if self.solved(): 
-            raise Exception("at least one value has to be possible")
-        else:
-            self.v.discard(value)
-        if recurse:
-            self.propagate()
-
-    def tostring(self, printAllPossibleValues=False):
-        if self.solved():
-            return str(self.getSolvedValue())
-        elif printAllPossibleValues:
-            dig = [str(x) for x in self.v]
-            # import pdb; pdb.set_trace()
-            return "[" + ",".join(dig) + "]"
-        else:
-            return UNKNOWN_DIGIT_DISPLAY
-
-
-class DigitGroup:
-    """Stuff common to groups of Digits, e.g. row, col, box"""
 
-    def __init__(self):
-        self.digits = []
+# bitmask with one bit per possible value: bit 0 = "1", .. bit 8 = "9"
+ALL_VALUES_MASK = 0x1FF
 
-    def append(self, d):
-        if not isinstance(d, Digit):
-            raise Exception("expecting a list of Digits")
-        self.digits.append(d)
-        
-    def not_possible(self, value):
-        for dig in self.digits:
-            if not dig.solved(): 
-                dig.not_possible(value)
-
-    def tostring(self, printAllPossibleValues=False):
-        st = ""
-        for dig in self.digits:
-            st += dig.tostring(printAllPossibleValues)
-            if printAllPossibleValues:
-                st += "\n"
-        if printAllPossibleValues:
-            st += "\n"
-        return st
+# translate table turning any accepted "unknown" character into "0",
+# so a puzzle line can be canonicalized in one C-level pass
+_UNKNOWN_TRANS = str.maketrans(UNKNOWN_DIGIT_INPUT,
+                               "0" * len(UNKNOWN_DIGIT_INPUT))
+_CELL_CHARS = "0123456789"
 
 
 def row_col_box(position):
     """return the row, column and box number.
-    Our convention is that the digits are strung together row0 .. row8
+    Our convention is that the cells are strung together row0 .. row8
     and boxes are counted left to right, then top to bottom
-    so that the 36th digit (self.digits[35]) is 
-    in the 4th row (self.rows[3]), 
-    in the 9th column (self.cols[8]) and 
-    in the 6th box (self.box[5]).
+    so that the 36th cell (cells[35]) is
+    in the 4th row (row 3),
+    in the 9th column (col 8) and
+    in the 6th box (box 5).
     """
-    r = int(position/9)
-    c = position % 9
-    b = int(r/3) * 3 + int(c/3)
+    (r,c) = divmod(position, 9)
+    b = (r // 3) * 3 + (c // 3)
     return (r,c,b)
 
 
+def _compute_peers():
+    """for each position, the 20 other positions sharing its row, col or box"""
+    peers = []
+    for position in range(81):
+        (r,c,b) = row_col_box(position)
+        p = set()
+        for other in range(81):
+            (r2,c2,b2) = row_col_box(other)
+            if other != position and (r2 == r or c2 == c or b2 == b):
+                p.add(other)
+        peers.append(tuple(sorted(p)))
+    return tuple(peers)
+
+# precomputed once: PEERS[i] lists the positions constrained by position i
+PEERS = _compute_peers()
+
+
+def _compute_groups():
+    """positions of the 27 groups: 9 rows, then 9 cols, then 9 boxes"""
+    groups = [[] for i in range(27)]
+    for position in range(81):
+        (r,c,b) = row_col_box(position)
+        groups[r].append(position)
+        groups[9 + c].append(position)
+        groups[18 + b].append(position)
+    return tuple([tuple(g) for g in groups])
+
+GROUPS = _compute_groups()
+
+# popcount lookup for every possible 9-bit candidate mask
+POPCOUNT = tuple([bin(i).count("1") for i in range(512)])
+
+
+def propagate_cells(cells, unsolved):
+    """run constraint propagation to a fixpoint on a flat cells array:
+    every solved cell's value is cleared from its peers until nothing
+    changes any more. Returns the updated unsolved count, or -1 if a
+    cell is left with no possible value (the grid is inconsistent)."""
+    # bind the lookup tables to locals; this loop is the hot spot and
+    # local loads are noticeably cheaper than module-global ones
+    peers = PEERS
+    groups = GROUPS
+    all_values = ALL_VALUES_MASK
+
+    # worklist of solved cells whose value still has to be cleared from
+    # their peers; seeded with everything already solved
+    pending = [i for i in range(81)
+               if cells[i] != 0 and cells[i] & (cells[i] - 1) == 0]
+
+    while True:
+        # drain the worklist: each solved cell eliminates its value
+        # from its peers exactly once, enqueueing peers it solves
+        while pending:
+            i = pending.pop()
+            v = cells[i]
+            for p in peers[i]:
+                old = cells[p]
+                new = old & ~v
+                if new != old:
+                    if new == 0:
+                        return -1  # two peers forced to the same value
+                    cells[p] = new
+                    if new & (new - 1) == 0:
+                        unsolved -= 1
+                        pending.append(p)
+
+        # hidden singles: a value that is possible in only one cell of
+        # a group must go there. once collects values seen in the group,
+        # twice the values seen in more than one cell.
+        for group in groups:
+            once = 0
+            twice = 0
+            for p in group:
+                v = cells[p]
+                twice |= once & v
+                once |= v
+            if once != all_values:
+                return -1  # some value has nowhere to go in this group
+            only = once & ~twice
+            if only:
+                for p in group:
+                    v = cells[p]
+                    hit = v & only
+                    if hit and v & (v - 1):
+                        if hit & (hit - 1):
+                            return -1  # one cell claims two hidden singles
+                        cells[p] = hit
+                        unsolved -= 1
+                        pending.append(p)
+        if not pending:
+            return unsolved
+
+
+def search_cells(cells, unsolved):
+    """solve a flat cells array by propagation plus backtracking.
+    Propagate to a fixpoint, then pick the unsolved cell with the
+    fewest candidates and try each candidate in turn on a copy.
+    Returns the solved cells array, or None if there is no solution."""
+    unsolved = propagate_cells(cells, unsolved)
+    if unsolved < 0:
+        return None  # dead end
+
+    # find the unsolved cell with the fewest candidates
+    best = -1
+    best_count = 10
+    for i in range(81):
+        c = POPCOUNT[cells[i]]
+        if 1 < c < best_count:
+            best = i
+            best_count = c
+    if best == -1:
+        return cells  # every cell is down to one candidate
+
+    m = cells[best]
+    while m:
+        b = m & -m
+        trial = cells[:]
+        trial[best] = b
+        result = search_cells(trial, unsolved - 1)
+        if result is not None:
+            return result
+        m ^= b
+    return None
+
+
 class Grid:
     """9x9 grid, top-level container"""
 
     def __init__(self):
         """initialize an empty grid"""
 
-        self.digits = []
-        self.rows = [DigitGroup() for i in range(9)]
-        self.cols = [DigitGroup() for i in range(9)]
-        self.boxes = [DigitGroup() for i in range(9)]
+        # one 16-bit mask per position; the whole grid is 162 bytes
+        self.cells = array("H", [ALL_VALUES_MASK] * 81)
         self.loaded = False
+        self._unsolved = 81  # kept up to date as cells get solved
 
-        for position in range(81):
-            (r,c,b) = row_col_box(position)
-            d = Digit(self, position, self.rows[r], self.cols[c], self.boxes[b])
-            self.digits.append(d)
-            self.rows[r].append(d)
-            self.cols[c].append(d)
-            self.boxes[b].append(d)
-        
+    def set_value(self, position, value):
+        """record a known value at a position"""
+        old = self.cells[position]
+        self.cells[position] = 1 << (int(value) - 1)
+        if old & (old - 1):
+            self._unsolved -= 1
 
     def number_unsolved(self):
-        """return the number of unsolved digits"""
-        unsolved = 0
-        for dig in self.digits:
-            if not dig.solved():
-                unsolved += 1
-        return unsolved
+        """return the number of unsolved cells"""
+        return self._unsolved
 
     def solved(self):
-        return (0 == self.number_unsolved())
+        return self._unsolved == 0
 
     def propagate_all(self):
-        for dig in self.digits:
-            dig.propagate()
+        """run constraint propagation to a fixpoint on this grid"""
+        self._unsolved = propagate_cells(self.cells, self._unsolved)
+
+    def solve(self):
+        """solve the grid with propagation plus backtracking search.
+        Returns True if a solution was found."""
+        self.propagate_all()
+        if self._unsolved < 0:
+            return False
+        result = search_cells(self.cells[:], self._unsolved)
+        if result is None:
+            return False
+        self.cells[:] = result
+        self._unsolved = 0
+        return True
 
     def load(self, puzzle):
         """Load a string representing the puzzle into the Grid, row by row.
@@ -177,51 +225,37 @@ class Grid:
         A carriage return skips to the next row."""
 
 
-        counter = 0;  # which Digit are we on
-        for c in puzzle:
-            if counter > 80:
-                # we have all 81 digits, ignore rest
-                break
-            elif c in "123456789":
-                if args.verbose:
-                    print "found digit   '{}', digit #{}, {} left unsolved".format(
-                        c, counter, self.number_unsolved())
-                self.digits[counter].setSolvedValue(c)
-                counter += 1
-            elif c in UNKNOWN_DIGIT_INPUT:
-                if args.verbose:
-                    print "found unknown '{}', digit #{}, {} left unsolved".format(
-                        c, counter, self.number_unsolved())
-                counter += 1
-            elif c in ROW_TERMINATOR:
-                # skip to next row, but only if not already at end or row
-                if counter % 9 != 0:
-                    if args.verbose:
-                        print "found row terminator; skipping to next row"
-                    counter = 9 * ( int(counter/9) +1 ) 
-            else:
-                # ignore anything else
-                pass
+        row = 0
+        for line in puzzle.translate(_UNKNOWN_TRANS).splitlines():
+            # one translate pass plus a filter leaves only cell characters
+            cells = "".join([c for c in line if c in _CELL_CHARS])
+            while cells and row <= 8:
+                for i, c in enumerate(cells[:9]):
+                    if c != "0":
+                        self.set_value(9 * row + i, c)
+                cells = cells[9:]
+                row += 1
 
         self.loaded = True
+        if args.verbose:
+            print(f"loaded grid, {self.number_unsolved()} left unsolved")
 
 
     def tostring(self, pretty = True):
-        counter = 0
         s = ""
-        for d in self.digits:
-            s += d.tostring()
-            if pretty:
-                counter += 1
-                if (counter % 9) == 0:
-                    s += "\n"
+        for position in range(81):
+            v = self.cells[position]
+            if v != 0 and v & (v - 1) == 0:
+                s += str(v.bit_length())
+            else:
+                s += UNKNOWN_DIGIT_DISPLAY
+            if pretty and position % 9 == 8:
+                s += "\n"
         return s
 
 
 if __name__ == "__main__":
 
-    MAX_ITERATIONS = 20
-    
     EXAMPLE_GRID = """
 ..67...8.
 ..426....
@@ -238,14 +272,40 @@ if __name__ == "__main__":
 
     parser.add_argument("filename", nargs="?",
                         help="file with a text description of the initial state of the puzzle")
-    parser.add_argument("-x", "--example", action="store_true", 
+    parser.add_argument("-x", "--example", action="store_true",
                         help="solve an example puzzle")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="treat each line of the file as one 81-character puzzle")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-v", "--verbose", action="store_true")
     group.add_argument("-q", "--quiet", action="store_true")
 
     args = parser.parse_args()
 
+    if args.batch:
+        # solve a whole bank of puzzles in one process, reusing the
+        # tables computed at import time
+        if not args.filename:
+            parser.print_help()
+            sys.exit(2)
+        solved = 0
+        total = 0
+        for line in open(args.filename):
+            line = line.strip()
+            if not line:
+                continue
+            total += 1
+            g = Grid()
+            g.load(line)
+            if g.solve():
+                solved += 1
+                print(g.tostring(pretty=False))
+            else:
+                print(f"cannot solve: {line}")
+        if not args.quiet:
+            print(f"solved {solved} of {total} puzzles")
+        sys.exit(0)
+
     g = Grid()
 
     if args.example:
@@ -260,27 +320,15 @@ if __name__ == "__main__":
         sys.exit(2)
 
     if not args.quiet:
-        print "\nloaded grid with {} unsolved:\n{}".format(
-            g.number_unsolved(), g.tostring())
-
-    for it in range(1,MAX_ITERATIONS):
-        if g.solved():
-            break
-        last_unsolved = g.number_unsolved()
-        g.propagate_all()
-        if g.number_unsolved() == last_unsolved:
-            print "cannot solve - stalled with {} unsolved\n{}".format(
-                g.number_unsolved(), g.tostring())
-            exit(0)
-        if g.number_unsolved() >0 and not args.quiet:
-            print "{} unsolved after iteration #{}:\n{}".format(
-                g.number_unsolved(), it, g.tostring())
-    iterations = it-1
+        print(f"\nloaded grid with {g.number_unsolved()} unsolved:\n{g.tostring()}")
+
+    if not g.solve():
+        print(f"cannot solve - no solution exists\n{g.tostring()}")
+        sys.exit(0)
 
     # print solution
     if not args.quiet:
-        print "found solution after {} iteration{}:".format(
-            iterations, ("" if iterations==1 else "s"))
-    print g.tostring()
+        print("found solution:")
+    print(g.tostring())
 
 